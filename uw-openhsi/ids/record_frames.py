@@ -23,11 +23,24 @@ General permission to copy or modify is hereby granted.
 """
 from ids_peak import ids_peak
 
+import os
+import threading
+import time
 from typing import Optional
 
 
 class IDSCam:
-    def __init__(self):
+    # Timeout of a single wait for a finished buffer. Keeps the loop responsive to
+    # Ctrl+C and device loss instead of blocking until the next frame arrives.
+    WAIT_TIMEOUT_MS = 20
+
+    def __init__(self, verbose: bool = False, buffer_count: int = 20):
+        """
+        `buffer_count` is the minimum number of buffers announced to the data stream.
+        The TL's own minimum is too low for high frame rates. The buffers are sized
+        for a full sensor frame, so with Mono8 the pool costs
+        buffer_count * WidthMax * HeightMax bytes, e.g. about 47 MB for 20 x 1936 x 1216.
+        """
         # Initialize library, has to be matched by a Library.Close() call
         ids_peak.Library.Initialize()
 
@@ -37,6 +50,25 @@ class IDSCam:
         self.remote_nodemap: Optional[ids_peak.NodeMap] = None
         self.data_stream: Optional[ids_peak.DataStream] = None
 
+        # Nodes used during acquisition, resolved once per NodeMap in `cache_nodes`
+        self._n_payload: Optional[ids_peak.IntegerNode] = None
+        self._n_acq_start: Optional[ids_peak.CommandNode] = None
+        self._n_acq_stop: Optional[ids_peak.CommandNode] = None
+        self._n_tl_locked: Optional[ids_peak.IntegerNode] = None
+        self._n_exposure: Optional[ids_peak.FloatNode] = None
+        self._n_width: Optional[ids_peak.IntegerNode] = None
+        self._n_height: Optional[ids_peak.IntegerNode] = None
+        self._n_width_max: Optional[ids_peak.IntegerNode] = None
+        self._n_height_max: Optional[ids_peak.IntegerNode] = None
+
+        self.buffer_count: int = buffer_count
+
+        # Frame statistics, only updated by the acquisition loop and read by the reporter thread
+        self.verbose: bool = verbose
+        self._frame_count: int = 0
+        self._last_frame_id: int = 0
+        self._device_lost = threading.Event()
+
         self.register_callbacks()
 
     @staticmethod
@@ -47,16 +79,20 @@ class IDSCam:
         """
         print(f"Found-Device-Callback: Key={device.Key()}")
 
-    @staticmethod
-    def device_lost(key: str):
+    def device_lost(self, key: str):
         """
         The 'lost' event is only called for this application's opened devices if
         a device is closed explicitly or if connection is lost while the reconnect is disabled,
         otherwise the 'disconnected' event is triggered.
         Other devices that were not opened or were opened by someone else still trigger
         a 'lost' event.
+
+        Losing our own device ends the acquisition loop, a 'disconnected' device
+        may still reconnect so it keeps the loop waiting.
         """
         print(f"Lost-Device-Callback: Key={key}")
+        if self.device is not None and key == self.device.Key():
+            self._device_lost.set()
 
     def ensure_compatible_buffers_and_restart_acquisition(
             self,
@@ -66,18 +102,19 @@ class IDSCam:
         After a reconnect the PayloadSize might have changed, e.g. due to
         a reboot and the last parameter state not being saved in the
         starting UserSet. Here we check the PayloadSize and
-        reallocate the buffers if we encounter a mismatch.
+        reallocate the buffers if they are too small to hold it.
 
         We also start the local and remote acquistion if necessary.
         """
-        payload_size = self.remote_nodemap.FindNode("PayloadSize").Value()
+        payload_size = self._n_payload.Value()
 
-        has_payload_size_mismatch = payload_size != self.data_stream.AnnouncedBuffers()[
-            0].Size()
+        needs_grow = payload_size > max(
+            buffer.Size() for buffer in self.data_stream.AnnouncedBuffers())
 
-        # The payload size might have changed. In this case it's required to reallocate the buffers.
-        if has_payload_size_mismatch:
-            print("PayloadSize has changed. Reallocating buffers...")
+        # The payload size might have grown. In this case it's required to reallocate the buffers.
+        # A smaller or equal payload fits the announced buffers, which are still queued.
+        if needs_grow:
+            print("PayloadSize has grown. Reallocating buffers...")
 
             is_data_stream_running = self.data_stream.IsGrabbing()
             if is_data_stream_running:
@@ -92,7 +129,7 @@ class IDSCam:
                 self.data_stream.StartAcquisition()
 
         if not reconnect_information.IsRemoteDeviceAcquisitionRunning():
-            self.remote_nodemap.FindNode("AcquisitionStart").Execute()
+            self._n_acq_start.Execute()
 
     def device_reconnected(self, device: ids_peak.Device,
                            reconnect_information: ids_peak.DeviceReconnectInformation):
@@ -111,6 +148,12 @@ class IDSCam:
             f"RemoteDeviceConfigurationRestored: {reconnect_information.IsRemoteDeviceConfigurationRestored()}"
         ))
 
+        # ids_peak normally keeps the remote NodeMap across a reconnect, so the cached nodes should
+        # still be valid. Looking them up again is only a precaution, and since it only happens on
+        # a reconnect the lookups stay off the acquisition path.
+        self.remote_nodemap = device.RemoteDevice().NodeMaps()[0]
+        self.cache_nodes()
+
         # Using the `reconnectInformation` the user can tell whether they need to take actions
         # in order to resume the image acquisition.
         if reconnect_information.IsSuccessful():
@@ -170,43 +213,137 @@ class IDSCam:
         self.device_manager.UnregisterDeviceDisconnectedCallback(
             self.device_disconnected_callback_handle)
 
+    def _report_loop(self):
+        """
+        Print the frame rate once per second, keeping stdout off the acquisition loop.
+        """
+        last_count = self._frame_count
+        last_time = time.monotonic()
+        while self.acquisition_running:
+            time.sleep(1.0)
+            count = self._frame_count
+            now = time.monotonic()
+            fps = (count - last_count) / (now - last_time)
+            print(f"Received {count} frames, last FrameID: {self._last_frame_id}, {fps:.1f} FPS")
+            last_count = count
+            last_time = now
+
+    @staticmethod
+    def pin_acquisition_thread():
+        """
+        Pin the calling thread to the highest CPU core it is allowed to run on and
+        give it the SCHED_FIFO real-time policy, so other processes (e.g. the ZED
+        recording) do not add jitter to the frame arrival path.
+
+        Returns the previous affinity and scheduling policy, to be handed to
+        `restore_thread_scheduling`. Entries are None for steps that were skipped.
+
+        Note: SCHED_FIFO requires root or the CAP_SYS_NICE capability, e.g.
+        `sudo setcap cap_sys_nice+ep $(readlink -f $(which python3))`.
+        Both steps are skipped on platforms that do not support them.
+        """
+        try:
+            affinity = os.sched_getaffinity(0)
+            # Only cores from the allowed set work inside a cpuset or container
+            os.sched_setaffinity(0, {max(affinity)})
+        except (AttributeError, OSError) as e:
+            affinity = None
+            print(f"Could not pin acquisition thread: {e}")
+
+        try:
+            policy = os.sched_getscheduler(0), os.sched_getparam(0)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except (AttributeError, OSError) as e:
+            policy = None
+            print(f"Could not set SCHED_FIFO for acquisition thread: {e}")
+
+        return affinity, policy
+
+    @staticmethod
+    def restore_thread_scheduling(saved):
+        """
+        Undo `pin_acquisition_thread` with the state it returned.
+        """
+        affinity, policy = saved
+        try:
+            if policy is not None:
+                os.sched_setscheduler(0, *policy)
+            if affinity is not None:
+                os.sched_setaffinity(0, affinity)
+        except OSError as e:
+            print(f"Could not restore scheduling of acquisition thread: {e}")
+
     def run_acquisition_loop(self):
         """
         Run the acquisition loop. The reconnect callback may abort this.
         """
 
+        # Clear before starting, so a device lost during start-up still ends the loop
+        self._device_lost.clear()
+
         # Lock writeable nodes during acquisition
-        self.remote_nodemap.FindNode("TLParamsLocked").SetValue(1)
+        self._n_tl_locked.SetValue(1)
 
         self.data_stream.StartAcquisition()
-        self.remote_nodemap.FindNode("AcquisitionStart").Execute()
-        self.remote_nodemap.FindNode("AcquisitionStart").WaitUntilDone()
+        self._n_acq_start.Execute()
+        self._n_acq_start.WaitUntilDone()
 
         self.acquisition_running = True
-        print("Starting acquisition...")
-        print("Now you can disconnect or reboot the device to trigger a reconnect!")
-        while self.acquisition_running:
-            try:
-                # Wait for finished/filled buffer event
-                buffer = self.data_stream.WaitForFinishedBuffer(
-                    ids_peak.Timeout.INFINITE_TIMEOUT)
-                print(f"Received FrameID: {buffer.FrameID()}")
-                # Put the buffer back in the pool, so it can be filled again
-                self.data_stream.QueueBuffer(buffer)
-            except KeyboardInterrupt:
-                print("Keyboard interrupt.")
-                break
-            except Exception as e:
-                print(f"Exception: {e}")
+        if __debug__ and self.verbose:
+            threading.Thread(target=self._report_loop, daemon=True).start()
+
+        # Pin after starting the reporter thread, so it does not inherit the core and real-time policy
+        saved_scheduling = self.pin_acquisition_thread()
+
+        try:
+            print("Starting acquisition...")
+            print("Now you can disconnect or reboot the device to trigger a reconnect!")
+            while self.acquisition_running and not self._device_lost.is_set():
+                try:
+                    # Wait for finished/filled buffer event
+                    buffer = self.data_stream.WaitForFinishedBuffer(
+                        self.WAIT_TIMEOUT_MS)
+                    self._frame_count += 1
+                    self._last_frame_id = buffer.FrameID()
+                    # Put the buffer back in the pool, so it can be filled again
+                    self.data_stream.QueueBuffer(buffer)
+
+                    # Several buffers may have finished while we were waiting, drain them without blocking
+                    while True:
+                        try:
+                            buffer = self.data_stream.WaitForFinishedBuffer(0)
+                        except ids_peak.TimeoutException:
+                            break
+                        self._frame_count += 1
+                        self._last_frame_id = buffer.FrameID()
+                        self.data_stream.QueueBuffer(buffer)
+                except ids_peak.TimeoutException:
+                    # No frame yet, check whether we should stop and wait again
+                    continue
+                except KeyboardInterrupt:
+                    print("Keyboard interrupt.")
+                    break
+                except Exception as e:
+                    print(f"Exception: {e}")
+                    # Back off so a persistent error does not busy-loop at real-time priority
+                    time.sleep(self.WAIT_TIMEOUT_MS / 1000)
+        finally:
+            # Give up the dedicated core and real-time policy before the teardown
+            self.restore_thread_scheduling(saved_scheduling)
 
+        self.acquisition_running = False
         print("Stopping acquisition...")
-        self.remote_nodemap.FindNode("AcquisitionStop").Execute()
-        self.remote_nodemap.FindNode("AcquisitionStop").WaitUntilDone()
+        # A lost device can no longer be reached, only the local data stream is stopped then
+        device_lost = self._device_lost.is_set()
+        if not device_lost:
+            self._n_acq_stop.Execute()
+            self._n_acq_stop.WaitUntilDone()
         self.data_stream.StopAcquisition(
             ids_peak.AcquisitionStopMode_Default)
 
-        # Unlock writeable nodes again
-        self.remote_nodemap.FindNode("TLParamsLocked").SetValue(0)
+        if not device_lost:
+            # Unlock writeable nodes again
+            self._n_tl_locked.SetValue(0)
 
     def open_device(self):
         # Open the first device
@@ -223,8 +360,24 @@ class IDSCam:
 
         print("Using Device " + self.device.DisplayName())
         self.remote_nodemap = self.device.RemoteDevice().NodeMaps()[0]
+        self.cache_nodes()
         self.data_stream = self.device.DataStreams()[0].OpenDataStream()
 
+    def cache_nodes(self):
+        """
+        Look up the nodes used during acquisition once, instead of searching the
+        NodeMap by name on every start, stop and reconnect.
+        """
+        self._n_payload = self.remote_nodemap.FindNode("PayloadSize")
+        self._n_acq_start = self.remote_nodemap.FindNode("AcquisitionStart")
+        self._n_acq_stop = self.remote_nodemap.FindNode("AcquisitionStop")
+        self._n_tl_locked = self.remote_nodemap.FindNode("TLParamsLocked")
+        self._n_exposure = self.remote_nodemap.FindNode("ExposureTime")
+        self._n_width = self.remote_nodemap.FindNode("Width")
+        self._n_height = self.remote_nodemap.FindNode("Height")
+        self._n_width_max = self.remote_nodemap.FindNode("WidthMax")
+        self._n_height_max = self.remote_nodemap.FindNode("HeightMax")
+
     def enable_reconnect(self):
         """
         We enable the reconnect by writing to the `ReconnectEnable` node
@@ -264,17 +417,35 @@ class IDSCam:
         #
         
 
+    def max_payload_size(self) -> int:
+        """
+        Estimate the PayloadSize of a full sensor frame by scaling the current
+        PayloadSize with the ratio between the maximum and the current ROI area.
+        """
+        payload_size = self._n_payload.Value()
+        width = self._n_width.Value()
+        height = self._n_height.Value()
+        width_max = self._n_width_max.Value()
+        height_max = self._n_height_max.Value()
+
+        # Round up so the estimate never ends up below the real full frame payload
+        return -(-payload_size * width_max * height_max // (width * height))
+
     def alloc_buffers(self):
         # Buffer size
-        payload_size = self.remote_nodemap.FindNode("PayloadSize").Value()
+        payload_size = self._n_payload.Value()
+
+        # Size the buffers for a full sensor frame, so later ROI changes do not
+        # require a reallocation
+        alloc_size = max(payload_size, self.max_payload_size())
 
-        # Minimum number of required buffers
-        buffer_count_max = self.data_stream.NumBuffersAnnouncedMinRequired()
+        # Use more than the minimum number of required buffers to absorb hiccups at high frame rates
+        buffer_count_max = max(self.data_stream.NumBuffersAnnouncedMinRequired(), self.buffer_count)
 
         # Allocate buffers and add them to the pool
         for buffer_count in range(buffer_count_max):
             # Let the TL allocate the buffers
-            buffer = self.data_stream.AllocAndAnnounceBuffer(payload_size)
+            buffer = self.data_stream.AllocAndAnnounceBuffer(alloc_size)
             # Put the buffer in the pool
             self.data_stream.QueueBuffer(buffer)
 
@@ -289,8 +460,8 @@ class IDSCam:
     def set_roi(self):
         # In order to restart the acquistion additonal steps are required:
         # see "The payload size might have changed." above
-        self.remote_nodemap.FindNode("Height").SetValue(512)
-        self.remote_nodemap.FindNode("Width").SetValue(512)
+        self._n_height.SetValue(512)
+        self._n_width.SetValue(512)
 
     def run(self):
         try:
@@ -308,7 +479,7 @@ class IDSCam:
 
             exposure_time = 50 # Ms
 
-            self.remote_nodemap.FindNode("ExposureTime").SetValue(exposure_time)
+            self._n_exposure.SetValue(exposure_time)
 
             # NOTE: Uncommenting this line will modify the PayloadSize without saving the
             # changes in the UserSet. If the device reboots (e.g. by losing and then regaining
@@ -337,5 +508,5 @@ class IDSCam:
 
 
 if __name__ == '__main__':
-    example = IDSCam()
+    example = IDSCam(verbose=True)
     example.run()
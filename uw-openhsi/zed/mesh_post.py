@@ -130,20 +130,14 @@ def main():
     mapping_state = sl.SPATIAL_MAPPING_STATE.NOT_ENABLED
     mapping_activated = False
 
+    # Free allocated memory before closing the camera
     image.free(memory_type=sl.MEM.CPU)
+    point_cloud.free()
     pymesh.clear()
     # Disable modules and close camera
     zed.disable_spatial_mapping()
     zed.disable_positional_tracking()
     zed.close()
-
-
-    # Free allocated memory before closing the camera
-    pymesh.clear()
-    image.free()
-    point_cloud.free()
-    # Close the ZED
-    zed.close()
    
           
 def parse_args(init):
@@ -29,10 +29,78 @@
 
 
 import argparse
-import pandas as pd
+import queue
+import threading
+import numpy as np
 import pyzed.sl as sl
+from numba import njit
 
 
+_RES_MAP = {
+    "HD2K": sl.RESOLUTION.HD2K,
+    "HD1200": sl.RESOLUTION.HD1200,
+    "HD1080": sl.RESOLUTION.HD1080,
+    "HD720": sl.RESOLUTION.HD720,
+    "SVGA": sl.RESOLUTION.SVGA,
+    "VGA": sl.RESOLUTION.VGA,
+}
+
+POSE_COLUMNS = ["Timestamp", "Tx", "Ty", "Tz", "Qx", "Qy", "Qz", "Qw"]
+# Number of poses kept in memory before they are appended to the CSV
+CHUNK = 8192
+# Index and Timestamp as integers, the pose rounded to 3 decimals
+POSE_FMT = ("%d", "%d") + ("%.3f",) * 7
+
+
+@njit(cache=True, fastmath=True)
+def _pack_pose(buf, i, ts, tr, ori):
+    # Compiled to straight-line stores, keeps the per-frame packing out of the interpreter
+    buf[i, 0] = ts
+    buf[i, 1] = tr[0]
+    buf[i, 2] = tr[1]
+    buf[i, 3] = tr[2]
+    buf[i, 4] = ori[0]
+    buf[i, 5] = ori[1]
+    buf[i, 6] = ori[2]
+    buf[i, 7] = ori[3]
+
+
+def _write_chunk(f, rows, start):
+    # Append a block of raw pose rows to the open CSV, numbering them from `start`
+    index = np.arange(start, start + len(rows))
+    np.savetxt(f, np.column_stack((index, rows)), delimiter=",", fmt=POSE_FMT)
+
+
+def _write_poses(poses, f, failed, errors):
+    # Consumer side of the pose pipeline: pack (timestamp, translation, orientation) items from
+    # `poses` into chunks and append them to `f` until the None sentinel arrives.
+    # On failure the exception goes to `errors` and `failed` is set. Any remaining items are
+    # discarded, so the grab loop never blocks on a full queue.
+    buf = np.empty((CHUNK, 8), dtype=np.float64)
+    n = 0
+    done = False
+    try:
+        while True:
+            item = poses.get()
+            if item is None:
+                done = True
+                break
+            idx = n % CHUNK
+            _pack_pose(buf, idx, *item)
+            n += 1
+            if idx == CHUNK - 1:
+                _write_chunk(f, buf, n - CHUNK)
+
+        # Write the rows of the last, partially filled chunk
+        tail = n % CHUNK
+        if tail:
+            _write_chunk(f, buf[:tail], n - tail)
+    except Exception as e:
+        errors.append(e)
+        failed.set()
+        while not done:
+            done = poses.get() is None
+
 
 def parse_args(init):
     if len(opt.input_svo_file) > 0 and (opt.input_svo_file.endswith(".svo") or opt.input_svo_file.endswith(".svo2")):
@@ -48,24 +116,10 @@ def parse_args(init):
             print("[Sample] Using Stream input, IP : ",ip_str)
         else :
             print("Unvalid IP format. Using live stream")
-    if ("resolution" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.HD2K
-        print("[Sample] Using Camera in resolution HD2K")
-    elif ("HD1200" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.HD1200
-        print("[Sample] Using Camera in resolution HD1200")
-    elif ("HD1080" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.HD1080
-        print("[Sample] Using Camera in resolution HD1080")
-    elif ("HD720" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.HD720
-        print("[Sample] Using Camera in resolution HD720")
-    elif ("SVGA" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.SVGA
-        print("[Sample] Using Camera in resolution SVGA")
-    elif ("VGA" in opt.resolution):
-        init.camera_resolution = sl.RESOLUTION.VGA
-        print("[Sample] Using Camera in resolution VGA")
+    resolution = _RES_MAP.get(opt.resolution.upper())
+    if resolution is not None:
+        init.camera_resolution = resolution
+        print("[Sample] Using Camera in resolution " + opt.resolution.upper())
     elif len(opt.resolution)>0: 
         print("[Sample] No valid resolution entered. Using default")
     else : 
@@ -96,87 +150,152 @@ def main():
         zed.close()
         exit()
 
-    # Track the camera position during 1000 frames
-    i = 0
     zed_pose = sl.Pose()
 
     zed_sensors = sl.SensorsData()
     runtime_parameters = sl.RuntimeParameters()
+
+    # Reused every frame, the SDK fills these in place
+    py_translation = sl.Translation()
+    py_orientation = sl.Orientation()
+    zed_imu_pose = sl.Transform()
+    acceleration = [0.0, 0.0, 0.0]
+    a_velocity = [0.0, 0.0, 0.0]
     
     can_compute_imu = zed.get_camera_information().camera_model != sl.MODEL.ZED
-    # Create an empty DataFrame
-    df = pd.DataFrame(columns=["Timestamp", "Tx", "Ty", "Tz", "Qx", "Qy", "Qz", "Qw"], dtype=object)
-
     nb_frames = zed.get_svo_number_of_frames()
 
-    print(nb_frames)
-    while i < nb_frames:
-        if zed.grab(runtime_parameters) == sl.ERROR_CODE.SUCCESS:
+    # Bounded, so a slow disk throttles the grab loop instead of queueing poses without limit
+    poses = queue.Queue(maxsize=256)
+    # Set by the writer thread if it fails, the exception is kept in `writer_errors`
+    failed = threading.Event()
+    writer_errors = []
+
+    # `can_compute_imu` is fixed once the camera is open, so pick a specialized loop up front
+    # instead of branching on it every frame. Both loops only grab and extract the pose, which
+    # is handed to the writer thread through `poses`. They stop at the end of the SVO and skip
+    # frames that fail to grab for any other reason, returning how many were skipped.
+    # The SDK methods and constants used per frame are bound to locals first, which saves the
+    # attribute and global lookups on every iteration.
+    def loop_no_imu():
+        grab = zed.grab
+        rtp = runtime_parameters
+        SUCCESS = sl.ERROR_CODE.SUCCESS
+        END_OF_SVO = sl.ERROR_CODE.END_OF_SVOFILE_REACHED
+        get_pos = zed.get_position
+        WORLD = sl.REFERENCE_FRAME.WORLD
+        get_translation = zed_pose.get_translation
+        get_orientation = zed_pose.get_orientation
+        put = poses.put
+        writer_failed = failed.is_set
+        skipped = 0
+
+        for _ in range(nb_frames):
+            # Nothing would be written anymore, stop grabbing
+            if writer_failed():
+                return skipped
+            err = grab(rtp)
+            if err != SUCCESS:
+                if err == END_OF_SVO:
+                    return skipped
+                skipped += 1
+                continue
             # Get the pose of the left eye of the camera with reference to the world frame
-            zed.get_position(zed_pose, sl.REFERENCE_FRAME.WORLD)
-            
+            get_pos(zed_pose, WORLD)
+
+            # get() returns new arrays, so they stay valid while the item waits in the queue
+            put((zed_pose.timestamp.get_milliseconds(),
+                 get_translation(py_translation).get(),
+                 get_orientation(py_orientation).get()))
+        return skipped
+
+    def loop_with_imu():
+        grab = zed.grab
+        rtp = runtime_parameters
+        SUCCESS = sl.ERROR_CODE.SUCCESS
+        END_OF_SVO = sl.ERROR_CODE.END_OF_SVOFILE_REACHED
+        get_pos = zed.get_position
+        WORLD = sl.REFERENCE_FRAME.WORLD
+        get_translation = zed_pose.get_translation
+        get_orientation = zed_pose.get_orientation
+        get_sensors = zed.get_sensors_data
+        IMAGE = sl.TIME_REFERENCE.IMAGE
+        get_imu_data = zed_sensors.get_imu_data
+        put = poses.put
+        writer_failed = failed.is_set
+        skipped = 0
+
+        for _ in range(nb_frames):
+            # Nothing would be written anymore, stop grabbing
+            if writer_failed():
+                return skipped
+            err = grab(rtp)
+            if err != SUCCESS:
+                if err == END_OF_SVO:
+                    return skipped
+                skipped += 1
+                continue
+            # Get the pose of the left eye of the camera with reference to the world frame
+            get_pos(zed_pose, WORLD)
 
             # Display the translation and timestamp
-            py_translation = sl.Translation()
-            tx = round(zed_pose.get_translation(py_translation).get()[0], 3)
-            ty = round(zed_pose.get_translation(py_translation).get()[1], 3)
-            tz = round(zed_pose.get_translation(py_translation).get()[2], 3)
+            tr = get_translation(py_translation).get()
             t_milli = zed_pose.timestamp.get_milliseconds()
-            #print("Translation: Tx: {0}, Ty: {1}, Tz {2}, Timestamp: {3}\n".format(tx, ty, tz, t_milli))
+            #print("Translation: Tx: {0}, Ty: {1}, Tz {2}, Timestamp: {3}\n".format(tr[0], tr[1], tr[2], t_milli))
 
             # Display the orientation quaternion
-            py_orientation = sl.Orientation()
-            qx = round(zed_pose.get_orientation(py_orientation).get()[0], 3)
-            qy = round(zed_pose.get_orientation(py_orientation).get()[1], 3)
-            qz = round(zed_pose.get_orientation(py_orientation).get()[2], 3)
-            qw = round(zed_pose.get_orientation(py_orientation).get()[3], 3)
-            #print("Orientation: Qx: {0}, Qy: {1}, Qz {2}, Qw: {3}\n".format(qx, qy, qz, qw))
+            ori = get_orientation(py_orientation).get()
+            #print("Orientation: Qx: {0}, Qy: {1}, Qz {2}, Qw: {3}\n".format(ori[0], ori[1], ori[2], ori[3]))
+
+            put((t_milli, tr, ori))
+
+            get_sensors(zed_sensors, IMAGE)
+            zed_imu = get_imu_data()
+            #Display the IMU acceleratoin
+            zed_imu.get_linear_acceleration(acceleration)
+            ax, ay, az = acceleration
+            #print("IMU Acceleration: Ax: {0}, Ay: {1}, Az {2}\n".format(ax, ay, az))
             
+            #Display the IMU angular velocity
+            zed_imu.get_angular_velocity(a_velocity)
+            vx, vy, vz = a_velocity
+            #print("IMU Angular Velocity: Vx: {0}, Vy: {1}, Vz {2}\n".format(vx, vy, vz))
 
-            new_data = pd.Series({
-                "Timestamp": zed_pose.timestamp.get_milliseconds(),
-                "Tx": tx,
-                "Ty": ty,
-                "Tz": tz,
-                "Qx": qx,  # Assuming orientation is also float
-                "Qy": qy,
-                "Qz": qz,
-                "Qw": qw,
-            })
-
-            df = pd.concat([df, new_data.to_frame().T], ignore_index=True)  # Append as row
-
-            if can_compute_imu:
-                zed.get_sensors_data(zed_sensors, sl.TIME_REFERENCE.IMAGE)
-                zed_imu = zed_sensors.get_imu_data()
-                #Display the IMU acceleratoin
-                acceleration = [0,0,0]
-                zed_imu.get_linear_acceleration(acceleration)
-                ax = round(acceleration[0], 3)
-                ay = round(acceleration[1], 3)
-                az = round(acceleration[2], 3)
-                #print("IMU Acceleration: Ax: {0}, Ay: {1}, Az {2}\n".format(ax, ay, az))
-                
-                #Display the IMU angular velocity
-                a_velocity = [0,0,0]
-                zed_imu.get_angular_velocity(a_velocity)
-                vx = round(a_velocity[0], 3)
-                vy = round(a_velocity[1], 3)
-                vz = round(a_velocity[2], 3)
-                #print("IMU Angular Velocity: Vx: {0}, Vy: {1}, Vz {2}\n".format(vx, vy, vz))
-
-                # Display the IMU orientation quaternion
-                zed_imu_pose = sl.Transform()
-                ox = round(zed_imu.get_pose(zed_imu_pose).get_orientation().get()[0], 3)
-                oy = round(zed_imu.get_pose(zed_imu_pose).get_orientation().get()[1], 3)
-                oz = round(zed_imu.get_pose(zed_imu_pose).get_orientation().get()[2], 3)
-                ow = round(zed_imu.get_pose(zed_imu_pose).get_orientation().get()[3], 3)
-                #print("IMU Orientation: Ox: {0}, Oy: {1}, Oz {2}, Ow: {3}\n".format(ox, oy, oz, ow))
-
-            i = i + 1
-    df.to_csv('pose.csv')
-    # Close the camera
-    zed.close()
+            # Display the IMU orientation quaternion
+            ox, oy, oz, ow = zed_imu.get_pose(zed_imu_pose).get_orientation().get()
+            #print("IMU Orientation: Ox: {0}, Oy: {1}, Oz {2}, Ow: {3}\n".format(ox, oy, oz, ow))
+        return skipped
+
+    print(nb_frames)
+    loop = loop_with_imu if can_compute_imu else loop_no_imu
+    try:
+        with open('pose.csv', 'w', newline='', buffering=1 << 20) as f:
+            # Header only, the rows follow chunk by chunk. The first, unnamed column is the row index
+            f.write("," + ",".join(POSE_COLUMNS) + "\n")
+            # A thread rather than a process, the SDK state has to stay in this process
+            writer = threading.Thread(target=_write_poses, args=(poses, f, failed, writer_errors))
+            writer.start()
+            try:
+                skipped = loop()
+                # Each skipped grab still used up one of the `nb_frames` iterations, so pose.csv
+                # may be short by up to that many frames
+                if skipped:
+                    print("Skipped " + str(skipped) + " frames that failed to grab")
+            finally:
+                # Let the writer drain the queue and write the last chunk. Only wait for queue space
+                # while the writer is still alive to take the sentinel.
+                while writer.is_alive():
+                    try:
+                        poses.put(None, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                writer.join()
+    finally:
+        # Close the camera, also if pose.csv could not be opened
+        zed.close()
+    if writer_errors:
+        raise writer_errors[0]
 
 if __name__ == "__main__":
     ## Reads a prerecorded svo and returns timestamped poses per image.
@@ -132,9 +132,9 @@ def main():
             #Get rotation and translation and displays it
             if tracking_state == sl.POSITIONAL_TRACKING_STATE.OK:
                 rotation = camera_pose.get_rotation_vector()
-                translation = camera_pose.get_translation(py_translation)
+                translation = camera_pose.get_translation(py_translation).get()
                 text_rotation = str((round(rotation[0], 2), round(rotation[1], 2), round(rotation[2], 2)))
-                text_translation = str((round(translation.get()[0], 2), round(translation.get()[1], 2), round(translation.get()[2], 2)))
+                text_translation = str((round(translation[0], 2), round(translation[1], 2), round(translation[2], 2)))
 
             pose_data = camera_pose.pose_data(sl.Transform())
             # Update rotation, translation and tracking state values in the OpenGL window
@@ -25,6 +25,7 @@ import pyzed.sl as sl
 from signal import signal, SIGINT
 import argparse 
 import os
+import time
 import numpy as np
 
 
@@ -65,14 +66,28 @@ def main():
     print("SVO is Recording, use Ctrl-C to stop.") # Start recording SVO, stop with Ctrl-C command
     frames_recorded = 0
 
-    while True:
+    # Compute the deadline once on the monotonic clock, it does not jump with wall clock changes.
+    # Without a duration the clock is never read and the loop runs until Ctrl-C.
+    now = time.monotonic
+    timed = opt.duration > 0
+    deadline = now() + opt.duration if timed else 0.0
+    while not timed or now() < deadline:
         if cam.grab(runtime) == sl.ERROR_CODE.SUCCESS : # Check that a new image is successfully acquired
             frames_recorded += 1
-            print("Frame count: " + str(frames_recorded), end="\r")
+            # Only update the counter every 32 frames, writing to the terminal can stall the grab loop
+            if (frames_recorded & 31) == 0:
+                sys.stdout.write("Frame count: " + str(frames_recorded) + "\r")
+                sys.stdout.flush()
+
+    # The throttled counter can be behind, print the final count and end the line
+    print("Frame count: " + str(frames_recorded))
+    cam.disable_recording()
+    cam.close()
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--output_svo_file', type=str, help='Path to the SVO file that will be written', required= True)
+    parser.add_argument('--duration', type=float, help='Recording duration in seconds, record until Ctrl-C if 0', default = 0)
     opt = parser.parse_args()
     if not opt.output_svo_file.endswith(".svo") and not opt.output_svo_file.endswith(".svo2"): 
         print("--output_svo_file parameter should be a .svo file but is not : ", opt.output_svo_file,"Exit program.")